@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import av
+
+logger = logging.getLogger(__name__)
+
+def create_decoder():
+    """Create an Opus decoder and a resampler to 16kHz mono s16."""
+    return {
+        "codec": av.CodecContext.create('opus', 'r'),
+        "resampler": av.AudioResampler(format='s16', layout='mono', rate=16000)
+    }
+
+def open_decoder(decoders, session_id):
+    """
+    Return the session's decoder state from decoders, creating it on first use.
+    Returns None if the decoder can't be created.
+    """
+    state = decoders.get(session_id)
+    if state is None:
+        try:
+            state = decoders[session_id] = create_decoder()
+            logger.info(f"Initialized Opus decoder/resampler for session {session_id}")
+        except Exception as e:
+            logger.error(f"Failed to initialize decoder for {session_id}: {e}")
+    return state
+
+def decode(state, session_id, packet_bytes):
+    """
+    Decodes an Opus packet and resamples to 16kHz PCM (s16le).
+    state is the session's decoder state (see open_decoder), session_id is only used for logging.
+    """
+    codec = state["codec"]
+    resampler = state["resampler"]
+
+    out_bytes = bytearray()
+
+    try:
+        # Create packet
+        packet = av.Packet(packet_bytes)
+
+        # Decode
+        frames = codec.decode(packet)
+
+        # Resample and collect
+        for frame in frames:
+            resampled_frames = resampler.resample(frame)
+            for r_frame in resampled_frames:
+                # s16 mono is a single packed plane, copy it straight into the output instead
+                # of going through to_ndarray().tobytes(). The plane buffer is padded, so
+                # slice it to the real sample count (2 bytes per sample).
+                out_bytes.extend(memoryview(r_frame.planes[0])[:r_frame.samples * 2])
+
+    except Exception as e:
+        logger.warning(f"Error decoding chunk for {session_id}: {e}")
+
+    return out_bytes
+
+# --- Worker process side ---
+# Decoder state for the sessions pinned to this worker
+# Format: {session_id: {"codec": av.CodecContext, "resampler": av.AudioResampler}}
+_STATE = {}
+
+def _decode_worker(session_id, packets):
+    pcm = bytearray()
+    # Releases run on this same single-process worker, so they can't interleave with a run
+    state = open_decoder(_STATE, session_id)
+    if state is None:
+        return pcm
+    for packet_bytes in packets:
+        pcm.extend(decode(state, session_id, packet_bytes))
+    return pcm
+
+def _release_worker(session_id):
+    _STATE.pop(session_id, None)
+
+class DecoderPool:
+    """
+    Runs Opus decoding in worker processes, so decode throughput scales with cores
+    instead of serializing on the GIL.
+    Decoders are stateful, so every session is pinned to one single-process worker.
+    """
+    def __init__(self, workers):
+        # Spawn rather than fork: the parent already runs gRPC threads
+        context = multiprocessing.get_context("spawn")
+        self._shards = [
+            ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(workers)
+        ]
+
+    def _shard(self, session_id):
+        return self._shards[hash(session_id) % len(self._shards)]
+
+    async def decode(self, session_id, packets):
+        """Decode a run of Opus packets from one session into one PCM buffer."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._shard(session_id), _decode_worker, session_id, packets)
+
+    def release(self, session_id):
+        """Drop the session's decoder in its worker (fire and forget)."""
+        self._shard(session_id).submit(_release_worker, session_id)
+
+    def shutdown(self):
+        for shard in self._shards:
+            shard.shutdown(wait=False, cancel_futures=True)
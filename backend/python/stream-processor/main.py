@@ -1,17 +1,19 @@
 import asyncio
+import itertools
 import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
 import grpc
-from concurrent import futures
 from fastapi import FastAPI
 import uvicorn
 from proto import stream_processor_pb2
 from proto import stream_processor_pb2_grpc
 from transcriber import AudioTranscriber
+import decoder
 import os
-import json
+import orjson
 import time
-import redis
-import av
+import redis.asyncio as aioredis
 
 # Configure logging
 from opentelemetry.instrumentation.logging import LoggingInstrumentor
@@ -22,13 +24,20 @@ LoggingInstrumentor().instrument(set_logging_format=True)
 # Set root logger level to INFO so other modules (transcriber) log info
 logging.getLogger().setLevel(logging.INFO)
 
-# logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger("cc-service")
 logger.setLevel(logging.INFO)
 # Silence noisy libraries
 logging.getLogger("faster_whisper").setLevel(logging.WARNING)
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
+# Max caption events written to Redis per pipeline round trip, and how long the writer
+# waits for more events to join a round trip
+REDIS_BATCH_SIZE = 32
+REDIS_FLUSH_WINDOW_S = 0.05
+
+# Decoded packets a stream may run ahead of transcription (~1.3s of 20ms Opus frames)
+DECODE_QUEUE_SIZE = 64
+
 # --- FastAPI Setup ---
 app = FastAPI(title="Real-Time Captioning Service")
 
@@ -40,132 +49,200 @@ async def health_check():
 class CaptioningService(stream_processor_pb2_grpc.CaptioningServiceServicer):
     def __init__(self):
         # Use 'tiny' (multilingual) instead of 'tiny.en' to support translation/non-English input
-        self.transcriber = AudioTranscriber(model_size="tiny", device="cpu", compute_type="int8")
+        # Device/compute type come from WHISPER_DEVICE / WHISPER_COMPUTE_TYPE (CPU int8 by default)
+        self.transcriber = AudioTranscriber(model_size="tiny")
+        # English-only deployments can send English sessions to a faster .en model instead
+        # (e.g. WHISPER_EN_MODEL=distil-small.en). Off by default since .en models cannot translate.
+        en_model = os.getenv("WHISPER_EN_MODEL")
+        self.en_transcriber = AudioTranscriber(model_size=en_model) if en_model else None
         
         # Initialize Redis
         try:
             # Assume Redis is at localhost:6379 or use env var
             redis_host = os.getenv("REDIS_HOST", "localhost")
             redis_port = int(os.getenv("REDIS_PORT", 6379))
-            self.redis_client = redis.Redis(host=redis_host, port=redis_port, db=0)
+            # Bounded pool shared by all sessions instead of an unlimited one
+            pool = aioredis.ConnectionPool(
+                host=redis_host,
+                port=redis_port,
+                db=0,
+                max_connections=int(os.getenv("REDIS_POOL", 64)),
+                # An unreachable Redis fails writes quickly instead of stalling stream teardown
+                socket_connect_timeout=float(os.getenv("REDIS_TIMEOUT_S", 2)),
+                socket_timeout=float(os.getenv("REDIS_TIMEOUT_S", 2)),
+            )
+            self.redis_client = aioredis.Redis(connection_pool=pool)
             logger.info(f"Connected to Redis at {redis_host}:{redis_port}")
         except Exception as e:
             logger.error(f"Failed to connect to Redis: {e}")
             self.redis_client = None
 
+        # Caption events waiting to be written to Redis, flushed by a background task so
+        # the caption stream never waits on a Redis round trip
+        # Format: (key, payload, future resolved once the write is done)
+        self.transcript_queue = None
+        self._transcript_task = None
+
         logger.info("CaptioningService initialized")
 
         # Buffer for accumulating audio chunks per session
         # Format: {session_id: bytearray}
         self.audio_buffers = {}
         
+        # Parsed session ids, so captions don't re-split them
+        # Format: {session_id: (transcript_key as bytes, user_id)}
+        self.sessions = {}
+
         # Audio Decoders per session
         # Format: {session_id: {"decoder": av.CodecContext, "resampler": av.AudioResampler}}
         self.decoders = {}
 
+        # Optionally decode in worker processes instead of a thread, sessions are pinned to a worker
+        decode_workers = int(os.getenv("DECODE_WORKERS", 0))
+        self.decode_pool = decoder.DecoderPool(decode_workers) if decode_workers > 0 else None
+
     def decode_chunk(self, session_id, packet_bytes):
         """
         Decodes an Opus packet and resamples to 16kHz PCM (s16le).
+        The session's decoder is created on the event loop (see _decode_stream), never here:
+        a run still in flight on the decode thread after cleanup_session must not bring it back.
         """
-        # Initialize decoder/resampler if new session
-        if session_id not in self.decoders:
-            try:
-                codec = av.CodecContext.create('opus', 'r')
-                resampler = av.AudioResampler(format='s16', layout='mono', rate=16000)
-                self.decoders[session_id] = {
-                    "codec": codec,
-                    "resampler": resampler
-                }
-                logger.info(f"Initialized Opus decoder/resampler for session {session_id}")
-            except Exception as e:
-                logger.error(f"Failed to initialize decoder for {session_id}: {e}")
-                return b""
+        state = self.decoders.get(session_id)
+        if state is None:
+            return b""
+        return decoder.decode(state, session_id, packet_bytes)
 
-        decoder_ctx = self.decoders[session_id]
-        codec = decoder_ctx["codec"]
-        resampler = decoder_ctx["resampler"]
+    def decode_chunks(self, session_id, packets):
+        """Decode a run of Opus packets from one session into one PCM buffer."""
+        pcm = bytearray()
+        for packet_bytes in packets:
+            pcm.extend(self.decode_chunk(session_id, packet_bytes))
+        return pcm
 
-        out_bytes = bytearray()
-        
+    async def _receive(self, request_iterator, packet_queue, session_ids):
+        """
+        Read the client's packets into packet_queue as (session_id, target_language, packet).
+        Ends with None, or with the exception that stopped the stream.
+        Every session id seen is added to session_ids, so the stream can clean them up
+        even if it ends before their audio is decoded.
+        """
+        target_language = None
+        try:
+            async for chunk in request_iterator:
+                # Every field access on the message builds a new bytes object, so read the packet once
+                audio_data = chunk.audio_data
+                # Ensure we have data
+                if not audio_data:
+                    continue
+
+                # Update target language if provided
+                if chunk.target_language:
+                    target_language = chunk.target_language
+
+                session_id = chunk.session_id
+                session_ids.add(session_id)
+                await packet_queue.put((session_id, target_language, audio_data))
+            await packet_queue.put(None)
+        except Exception as e:
+            await packet_queue.put(e)
+
+    async def _decode_stream(self, request_iterator, pcm_queue, session_ids):
+        """
+        Receive and decode the client's packets into pcm_queue as (session_id, target_language, pcm).
+        Ends with None, or with the exception that stopped the stream.
+        """
+        packet_queue = asyncio.Queue(maxsize=DECODE_QUEUE_SIZE)
+        receiver = asyncio.create_task(self._receive(request_iterator, packet_queue, session_ids))
         try:
-            # Create packet
-            packet = av.Packet(packet_bytes)
-            
-            # Decode
-            frames = codec.decode(packet)
-            
-            # Resample and collect
-            for frame in frames:
-                resampled_frames = resampler.resample(frame)
-                for r_frame in resampled_frames:
-                    out_bytes.extend(r_frame.to_ndarray().tobytes())
-                    
+            while True:
+                # Packets are 20ms each, so decode everything that queued up during the last
+                # decode in one hop to the decoder thread/worker instead of one hop per packet
+                batch = [await packet_queue.get()]
+                while not packet_queue.empty():
+                    batch.append(packet_queue.get_nowait())
+                # Only the last item can be the end of the stream
+                end = batch.pop() if not isinstance(batch[-1], tuple) else False
+
+                for (session_id, target_language), run in itertools.groupby(batch, key=lambda item: item[:2]):
+                    packets = [item[2] for item in run]
+                    # Decode Opus to PCM (offload to a worker process or thread to avoid blocking event loop)
+                    if self.decode_pool:
+                        pcm_data = await self.decode_pool.decode(session_id, packets)
+                    else:
+                        decoder.open_decoder(self.decoders, session_id)
+                        pcm_data = await asyncio.to_thread(self.decode_chunks, session_id, packets)
+                    await pcm_queue.put((session_id, target_language, pcm_data))
+
+                if end is not False:
+                    await pcm_queue.put(end)
+                    return
         except Exception as e:
-            logger.warning(f"Error decoding chunk for {session_id}: {e}")
-            
-        return bytes(out_bytes)
+            await pcm_queue.put(e)
+        finally:
+            receiver.cancel()
 
     async def StreamAudio(self, request_iterator, context):
         session_id = "unknown"
-        target_language = None
         
         # Threshold for processing (e.g., 3.0 seconds of audio at 16kHz 16-bit mono = 96000 bytes)
         # Whisper works best with > 3s of context.
         BUFFER_THRESHOLD = int(os.getenv("BUFFER_THRESHOLD_BYTES", 96000)) 
 
-        try:
-            async for chunk in request_iterator:
-                # Ensure we have data
-                if len(chunk.audio_data) == 0:
-                    continue
+        # Receiving/decoding runs as its own stage, so the client's packets keep being decoded
+        # while a chunk is transcribed. The bounded queue is the back-pressure: if transcription
+        # falls behind, decoding pauses and gRPC flow control throttles the client.
+        pcm_queue = asyncio.Queue(maxsize=DECODE_QUEUE_SIZE)
+        # This stream's transcript writes still in flight
+        writes = set()
+        # Sessions this stream has received packets for, filled in by the receiving stage
+        session_ids = set()
+        decode_task = asyncio.create_task(self._decode_stream(request_iterator, pcm_queue, session_ids))
 
-                session_id = chunk.session_id
-                
-                # Update target language if provided
-                if chunk.target_language:
-                    target_language = chunk.target_language
+        try:
+            while (item := await pcm_queue.get()) is not None:
+                if isinstance(item, Exception):
+                    raise item
+                session_id, target_language, pcm_data = item
 
                 if session_id not in self.audio_buffers:
                     self.audio_buffers[session_id] = bytearray()
                 
-                # Decode Opus packet to PCM (offload to thread to avoid blocking event loop)
-                pcm_data = await asyncio.to_thread(self.decode_chunk, session_id, chunk.audio_data)
-                
                 # Append to buffer
                 if pcm_data:
                     self.audio_buffers[session_id].extend(pcm_data)
 
                 # Only process if buffer exceeds threshold
                 if len(self.audio_buffers[session_id]) >= BUFFER_THRESHOLD:
-                    # Drain buffer for processing
-                    audio_to_process = bytes(self.audio_buffers[session_id])
-                    self.audio_buffers[session_id].clear()
+                    # Drain buffer for processing: hand the filled buffer over and start a fresh
+                    # one rather than copying it out with bytes() and clearing it
+                    audio_to_process = self.audio_buffers[session_id]
+                    self.audio_buffers[session_id] = bytearray()
+
+                    transcriber = self.transcriber
+                    if self.en_transcriber and (not target_language or target_language.lower().startswith("en")):
+                        transcriber = self.en_transcriber
 
-                    results = await self.transcriber.transcribe_chunk(audio_to_process, target_language=target_language)
+                    results = await transcriber.transcribe_chunk(audio_to_process, target_language=target_language)
 
                     for res in results:
                         if res['text']:
-                            logger.info(f"CAPTION [{session_id}]: {res['text']}")
-                            # Parse session_id (room_id:user_id)
-                            parts = session_id.split(":")
-                            room_id = parts[0] if len(parts) > 0 else "unknown"
-                            user_id = parts[1] if len(parts) > 1 else "unknown"
+                            logger.debug("CAPTION [%s]: %s", session_id, res['text'])
+                            transcript_key, user_id = self.session_info(session_id)
 
                             # Push to Redis for summarization
                             # Format: transcript:{room_id} -> JSON list of events
-                            # We use RPUSH to append.
-                            try:
-                                event_data = {
-                                    "user_id": user_id,
-                                    "text": res['text'],
-                                    "timestamp": time.time(),
-                                    "confidence": res['confidence']
-                                }
-                                # self.redis_client is initialized in __init__
-                                if self.redis_client:
-                                    self.redis_client.rpush(f"transcript:{room_id}", json.dumps(event_data))
-                            except Exception as e:
-                                logger.error(f"Redis error: {e}")
+                            # We use RPUSH to append (batched in the background).
+                            event_data = {
+                                "user_id": user_id,
+                                "text": res['text'],
+                                "ts_ns": time.time_ns(),
+                                "confidence": res['confidence']
+                            }
+                            # self.redis_client is initialized in __init__
+                            if self.redis_client:
+                                write = self.queue_transcript(transcript_key, orjson.dumps(event_data))
+                                writes.add(write)
+                                write.add_done_callback(writes.discard)
 
                             yield stream_processor_pb2.CaptionEvent(
                                 session_id=session_id,
@@ -176,7 +253,77 @@ class CaptioningService(stream_processor_pb2_grpc.CaptioningServiceServicer):
         except Exception as e:
             logger.error(f"Error in StreamAudio for session {session_id}: {e}")
         finally:
-            self.cleanup_session(session_id)
+            decode_task.cancel()
+            # Make sure this stream's captions reach Redis before it ends
+            await self.flush_transcripts(writes)
+            # Includes sessions whose packets never made it through decoding (e.g. cancelled early)
+            for sid in session_ids:
+                self.cleanup_session(sid)
+
+    def queue_transcript(self, key, payload):
+        """
+        Queue a transcript event for the background Redis writer.
+        Returns a future that is resolved once the event has been written (or failed).
+        """
+        loop = asyncio.get_running_loop()
+        if self._transcript_task is None or self._transcript_task.done() or self._transcript_task.get_loop() is not loop:
+            self.transcript_queue = asyncio.Queue()
+            self._transcript_task = loop.create_task(self._write_transcripts())
+        done = loop.create_future()
+        self.transcript_queue.put_nowait((key, payload, done))
+        return done
+
+    async def flush_transcripts(self, writes):
+        """
+        Wait until the given queue_transcript() writes are done. Only these: other streams'
+        captions keep flowing through the same writer and must not hold this one up.
+        """
+        if writes:
+            await asyncio.wait(writes)
+
+    async def _write_transcripts(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.transcript_queue.get()]
+            # Collect whatever else (any session) arrives within the flush window
+            deadline = loop.time() + REDIS_FLUSH_WINDOW_S
+            while len(batch) < REDIS_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.transcript_queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # One RPUSH per room with all of its events, in arrival order
+            events = {}
+            for key, payload, _ in batch:
+                events.setdefault(key, []).append(payload)
+
+            try:
+                # One round trip for the whole batch
+                pipe = self.redis_client.pipeline(transaction=False)
+                for key, payloads in events.items():
+                    pipe.rpush(key, *payloads)
+                await pipe.execute()
+            except Exception as e:
+                logger.error(f"Redis error: {e}")
+            finally:
+                for _, _, done in batch:
+                    if not done.done():
+                        done.set_result(None)
+
+    def session_info(self, session_id):
+        """Return the Redis transcript key and user id for a room_id:user_id session id."""
+        info = self.sessions.get(session_id)
+        if info is None:
+            parts = session_id.split(":")
+            room_id = parts[0] if len(parts) > 0 else "unknown"
+            user_id = parts[1] if len(parts) > 1 else "unknown"
+            # Key pre-encoded, so redis-py doesn't encode it again for every write
+            info = self.sessions[session_id] = (f"transcript:{room_id}".encode(), user_id)
+        return info
 
     def cleanup_session(self, session_id):
         """Cleanup session resources to prevent memory leaks."""
@@ -184,12 +331,27 @@ class CaptioningService(stream_processor_pb2_grpc.CaptioningServiceServicer):
             logger.info(f"Cleaning up resources for session {session_id}")
             if session_id in self.audio_buffers:
                 del self.audio_buffers[session_id]
+            self.sessions.pop(session_id, None)
             if session_id in self.decoders:
                 del self.decoders[session_id]
+            if self.decode_pool:
+                self.decode_pool.release(session_id)
 
-async def serve_grpc():
-    server = grpc.aio.server(futures.ThreadPoolExecutor(max_workers=10))
-    stream_processor_pb2_grpc.add_CaptioningServiceServicer_to_server(CaptioningService(), server)
+async def serve_grpc(service=None):
+    # Handlers are all async and run on the event loop, so no thread pool is needed
+    server = grpc.aio.server(options=[
+        ("grpc.so_reuseport", 1),
+        ("grpc.max_concurrent_streams", 128),
+        ("grpc.http2.max_pings_without_data", 0),
+        # Keep long-lived streams alive through idle proxies/NATs and detect dead peers
+        ("grpc.keepalive_time_ms", 20000),
+        ("grpc.keepalive_timeout_ms", 10000),
+        ("grpc.http2.min_time_between_pings_ms", 10000),
+        # Let flow-control windows grow with the measured bandwidth-delay product
+        ("grpc.http2.bdp_probe", 1),
+        ("grpc.http2.write_buffer_size", 1 << 20),
+    ])
+    stream_processor_pb2_grpc.add_CaptioningServiceServicer_to_server(service or CaptioningService(), server)
     port = os.getenv("GRPC_PORT", "50051")
     listen_addr = f'[::]:{port}'
     server.add_insecure_port(listen_addr)
@@ -198,17 +360,43 @@ async def serve_grpc():
     await server.wait_for_termination()
 
 async def serve_http():
-    config = uvicorn.Config(app, host="0.0.0.0", port=8000, log_level="info")
+    # Served on the same event loop as the gRPC server; httptools is the C HTTP/1.1 parser
+    config = uvicorn.Config(app, host="0.0.0.0", port=8000, log_level="info", http="httptools")
     server = uvicorn.Server(config)
     logger.info("Starting FastAPI server on http://0.0.0.0:8000")
     await server.serve()
 
+def start_log_listener():
+    """
+    Move the root handlers behind a queue, so logging calls on the event loop only enqueue
+    the record and formatting/writing to stderr happens on the listener thread.
+    """
+    root = logging.getLogger()
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, *root.handlers, respect_handler_level=True)
+    root.handlers = [QueueHandler(log_queue)]
+    listener.start()
+    return listener
+
 async def main():
-    # Run both servers concurrently
-    await asyncio.gather(
-        serve_grpc(),
-        serve_http()
-    )
+    listener = start_log_listener()
+    try:
+        # Load (and warm) the Whisper models before either server starts listening, so
+        # the load doesn't stall the event loop and the first stream doesn't pay for it
+        service = CaptioningService()
+        # Run both servers concurrently
+        await asyncio.gather(
+            serve_grpc(service),
+            serve_http()
+        )
+    finally:
+        listener.stop()
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    try:
+        # libuv-based event loop, faster socket I/O for gRPC/HTTP (not available on Windows)
+        import uvloop
+        run = uvloop.run
+    except ImportError:
+        run = asyncio.run
+    run(main())
@@ -0,0 +1,62 @@
+import itertools
+import os
+import pickle
+import av
+import numpy as np
+import pytest
+
+# Path to the test audio file
+AUDIO_FILE = os.path.join(os.path.dirname(__file__), "jfk.wav")
+
+def encode_opus(filename):
+    """Encode a WAV file into the 48kHz mono Opus packets the SFU would send."""
+    # Decode and resample the whole file in one go.
+    # The SFU sends 48kHz Opus, our WAV is 16kHz: resample to 48kHz float planar (what Opus takes).
+    resampler = av.AudioResampler(
+        format='fltp',
+        layout='mono',
+        rate=48000,
+    )
+    with av.open(filename) as container:
+        # A trailing None flushes the resampler
+        pcm = np.concatenate([
+            r_frame.to_ndarray()
+            for frame in itertools.chain(container.decode(audio=0), [None])
+            for r_frame in resampler.resample(frame)
+        ], axis=1)
+
+    # Standalone Opus encoder: we only want the packets, so no output container
+    # (and no muxer/format lookup) is needed
+    encoder = av.CodecContext.create('opus', 'w')
+    encoder.sample_rate = 48000
+    encoder.layout = 'mono'
+    encoder.format = 'fltp'
+
+    # Encode the whole signal as one frame, PyAV splits it into Opus-sized frames
+    frame = av.AudioFrame.from_ndarray(pcm, format='fltp', layout='mono')
+    frame.sample_rate = 48000
+    packets = encoder.encode(frame) + encoder.encode(None)  # None flushes the encoder
+    return [bytes(packet) for packet in packets]
+
+@pytest.fixture(scope="session")
+def opus_packets(request):
+    """
+    jfk.wav as Opus packets. Encoded once per session and kept in the pytest cache
+    (.pytest_cache) across runs, keyed by the file's mtime and size.
+    """
+    if not os.path.exists(AUDIO_FILE):
+        pytest.skip(f"Audio file {AUDIO_FILE} not found")
+
+    cache = getattr(request.config, "cache", None)
+    if cache is None:
+        # Cache plugin disabled (-p no:cacheprovider), e.g. read-only CI
+        return encode_opus(AUDIO_FILE)
+
+    stat = os.stat(AUDIO_FILE)
+    path = cache.mkdir("opus") / f"jfk-{stat.st_mtime_ns}-{stat.st_size}-48k-mono.pkl"
+    if path.exists():
+        return pickle.loads(path.read_bytes())
+
+    packets = encode_opus(AUDIO_FILE)
+    path.write_bytes(pickle.dumps(packets))
+    return packets
@@ -1,6 +1,7 @@
 import pytest
 import asyncio
 from unittest.mock import MagicMock, AsyncMock, patch
+import orjson
 from proto import stream_processor_pb2
 
 # Import the class we want to test. 
@@ -15,7 +16,8 @@ def mock_transcriber_class():
 
 @pytest.fixture
 def mock_redis():
-    with patch("redis.Redis") as MockRedis:
+    with patch("main.aioredis.Redis") as MockRedis:
+        MockRedis.return_value.pipeline.return_value.execute = AsyncMock()
         yield MockRedis
 
 @pytest.fixture
@@ -121,3 +123,150 @@ async def test_session_isolation(service):
 
     assert len(service.audio_buffers["sessionA"]) == 2000
     assert len(service.audio_buffers["sessionB"]) == 1000
+
+@pytest.mark.asyncio
+async def test_transcripts_written_in_one_pipeline(service):
+    """Captions produced together reach Redis in a single pipelined round trip."""
+    session_id = "room1:user1"
+    service.transcriber.transcribe_chunk.return_value = [
+        {"text": "First", "confidence": 0.9},
+        {"text": "Second", "confidence": 0.8},
+    ]
+
+    async def request_iterator():
+        yield stream_processor_pb2.AudioChunk(session_id=session_id, audio_data=b'\x00' * 100000)
+
+    responses = [response async for response in service.StreamAudio(request_iterator(), None)]
+    assert [r.text for r in responses] == ["First", "Second"]
+
+    pipe = service.redis_client.pipeline.return_value
+    # Both events for the room go out as one multi-value RPUSH
+    pipe.rpush.assert_called_once()
+    key, *payloads = pipe.rpush.call_args.args
+    assert key == b"transcript:room1"
+    assert [orjson.loads(p)["text"] for p in payloads] == ["First", "Second"]
+    pipe.execute.assert_awaited_once()
+
+@pytest.mark.asyncio
+async def test_decoding_overlaps_transcription(service):
+    """Packets keep being decoded while an earlier chunk is being transcribed."""
+    session_id = "room1:user1"
+    release = asyncio.Event()
+    decoded_during_transcription = []
+
+    async def slow_transcribe(audio, target_language=None):
+        # Let the decode stage run while this chunk is "on the model"
+        await asyncio.sleep(0.1)
+        decoded_during_transcription.append(service.decode_chunk.call_count)
+        release.set()
+        return []
+
+    service.transcriber.transcribe_chunk = AsyncMock(side_effect=slow_transcribe)
+
+    async def request_iterator():
+        yield stream_processor_pb2.AudioChunk(session_id=session_id, audio_data=b'\x00' * 100000)
+        for _ in range(5):
+            yield stream_processor_pb2.AudioChunk(session_id=session_id, audio_data=b'\x00' * 100)
+        await release.wait()
+
+    async for _ in service.StreamAudio(request_iterator(), None):
+        pass
+
+    assert decoded_during_transcription == [6]
+    # Nothing lost: packets decoded together with the first one went into its chunk, the rest are buffered
+    transcribed = len(service.transcriber.transcribe_chunk.call_args.args[0])
+    assert transcribed + len(service.audio_buffers[session_id]) == 100500
+
+@pytest.mark.asyncio
+async def test_queued_packets_decoded_together(service):
+    """Packets that arrive while a decode is running go to the decoder in one call."""
+    session_id = "room1:user1"
+    service.decode_chunks = MagicMock(side_effect=lambda sid, packets: b"".join(packets))
+
+    async def request_iterator():
+        for _ in range(10):
+            yield stream_processor_pb2.AudioChunk(session_id=session_id, audio_data=b'\x00' * 100)
+
+    async for _ in service.StreamAudio(request_iterator(), None):
+        pass
+
+    assert service.decode_chunks.call_count < 10
+    assert sum(len(call.args[1]) for call in service.decode_chunks.call_args_list) == 10
+    assert len(service.audio_buffers[session_id]) == 1000
+
+@pytest.mark.asyncio
+async def test_transcripts_within_flush_window_share_round_trip(service):
+    """Captions from different sessions a few ms apart are written in the same pipeline."""
+    first = service.queue_transcript(b"transcript:room1", b'{"text": "a"}')
+    await asyncio.sleep(0.01)
+    second = service.queue_transcript(b"transcript:room2", b'{"text": "b"}')
+    await service.flush_transcripts({first, second})
+
+    pipe = service.redis_client.pipeline.return_value
+    pipe.execute.assert_awaited_once()
+    assert [call.args[0] for call in pipe.rpush.call_args_list] == [b"transcript:room1", b"transcript:room2"]
+
+@pytest.mark.asyncio
+async def test_full_buffer_handed_over_without_copy(service):
+    """The filled session bytearray itself goes to the transcriber, and a fresh one takes its place."""
+    session_id = "room1:user1"
+
+    async def request_iterator():
+        yield stream_processor_pb2.AudioChunk(session_id=session_id, audio_data=b'\x00' * 50000)
+        yield stream_processor_pb2.AudioChunk(session_id=session_id, audio_data=b'\x00' * 50000)
+
+    async for _ in service.StreamAudio(request_iterator(), None):
+        pass
+
+    handed_over = service.transcriber.transcribe_chunk.call_args.args[0]
+    assert type(handed_over) is bytearray
+    assert len(handed_over) == 100000
+    assert handed_over is not service.audio_buffers[session_id]
+    assert len(service.audio_buffers[session_id]) == 0
+
+@pytest.mark.asyncio
+async def test_session_cleaned_up_when_stream_ends_before_decoding(service):
+    """A stream that fails before any audio is decoded still releases its session."""
+    session_id = "room1:user1"
+    service.decode_chunks = MagicMock(side_effect=RuntimeError("decoder crashed"))
+
+    async def request_iterator():
+        yield stream_processor_pb2.AudioChunk(session_id=session_id, audio_data=b'\x00' * 100)
+
+    async for _ in service.StreamAudio(request_iterator(), None):
+        pass
+
+    service.cleanup_session.assert_called_once_with(session_id)
+
+def test_decode_after_cleanup_does_not_recreate_decoder(service):
+    """A decode run still in flight when its session is cleaned up must not bring the decoder back."""
+    # The fixture stubs decode_chunk out, call the real one
+    assert CaptioningService.decode_chunk(service, "room1:user1", b'\x00' * 10) == b""
+    assert "room1:user1" not in service.decoders
+
+@pytest.mark.asyncio
+async def test_flush_waits_only_for_own_writes(service):
+    """Ending a stream doesn't wait on captions other streams queued behind it."""
+    release = asyncio.Event()
+
+    pipe = service.redis_client.pipeline.return_value
+
+    async def execute():
+        # The first batch goes through, the second hangs until released
+        if pipe.execute.await_count > 1:
+            await release.wait()
+
+    pipe.execute = AsyncMock(side_effect=execute)
+
+    own = service.queue_transcript(b"transcript:room1", b'{"text": "mine"}')
+    await asyncio.sleep(0.1)
+    # Another room's caption, stuck on a slow Redis write
+    other = service.queue_transcript(b"transcript:room2", b'{"text": "theirs"}')
+
+    await asyncio.wait_for(service.flush_transcripts({own}), timeout=1)
+    await asyncio.sleep(0.1)
+    assert pipe.execute.await_count == 2
+    assert not other.done()
+
+    release.set()
+    await service.flush_transcripts({other})
@@ -21,7 +21,8 @@ def mock_transcriber_class():
 
 @pytest.fixture
 def mock_redis():
-    with patch("main.redis.Redis") as MockRedis:
+    with patch("main.aioredis.Redis") as MockRedis:
+        MockRedis.return_value.pipeline.return_value.execute = AsyncMock()
         yield MockRedis
 
 @pytest.fixture
@@ -0,0 +1,24 @@
+import pytest
+import decoder
+
+@pytest.mark.asyncio
+async def test_decoder_pool_matches_in_process_decode(opus_packets):
+    packets = opus_packets[:50]
+
+    state = decoder.open_decoder({}, "room1:user1")
+    expected = bytearray()
+    for packet in packets:
+        expected.extend(decoder.decode(state, "room1:user1", packet))
+
+    pool = decoder.DecoderPool(2)
+    try:
+        # Decoder state must carry across packets, which only works if the session stays on one worker
+        pcm = bytearray()
+        for i in range(0, len(packets), 10):
+            pcm.extend(await pool.decode("room1:user1", packets[i:i + 10]))
+        pool.release("room1:user1")
+    finally:
+        pool.shutdown()
+
+    assert len(expected) > 0
+    assert pcm == expected
@@ -1,4 +1,3 @@
-import av
 import pytest
 import pytest_asyncio
 import asyncio
@@ -6,16 +5,13 @@ import grpc
 import os
 import wave
 import json
-from unittest.mock import MagicMock, patch
+from unittest.mock import AsyncMock, MagicMock, patch
 from proto import stream_processor_pb2, stream_processor_pb2_grpc
 from main import serve_grpc
 
-# Path to the test audio file
-AUDIO_FILE = os.path.join(os.path.dirname(__file__), "jfk.wav")
-
 @pytest.fixture
 def mock_redis():
-    with patch("main.redis.Redis") as MockRedis, \
+    with patch("main.aioredis.Redis") as MockRedis, \
          patch("main.os.getenv") as mock_getenv:
         
         # Configure getenv to allow GRPC_PORT passthrough while mocking REDIS envs if needed
@@ -27,6 +23,7 @@ def mock_redis():
         mock_getenv.side_effect = side_effect
         
         mock_instance = MockRedis.return_value
+        mock_instance.pipeline.return_value.execute = AsyncMock()
         yield mock_instance
 
 @pytest_asyncio.fixture
@@ -50,56 +47,13 @@ async def grpc_server(mock_redis):
     except asyncio.CancelledError:
         pass
 
-def get_audio_chunks(filename, chunk_size=32000, session_id="test_room:test_user"):
-    # Initialize Opus encoder
-    # SFU sends 48kHz stereo or mono? Usually 48kHz.
-    # We will simulate 48kHz Opus from our 16kHz WAV.
-    # PyAV handles resampling automatically if we configure the output codec correctly.
-    
-    # Open WAV
-    container = av.open(filename)
-    stream = container.streams.audio[0]
-    
-    # Create Opus Encoder using a dummy container
-    # 'null' format behaves like /dev/null
-    output_container = av.open('null', 'w', format='null')
-    # Configure via add_stream arguments
-    # Opus supports 48kHz, mono/stereo (1 or 2 channels), and usually flt/fltp format
-    output_stream = output_container.add_stream('opus', rate=48000, layout='mono', format='fltp')
-    
-    # Set up resampler from source to 48kHz
-    # Opus uses 'fltp' (float planar) usually.
-    resampler = av.AudioResampler(
-        format='fltp',
-        layout='mono',
-        rate=48000,
-    )
-
-    for frame in container.decode(stream):
-        # Resample to 48kHz fltp
-        resampled_frames = resampler.resample(frame)
-        for r_frame in resampled_frames:
-            # Encode
-            packets = output_stream.encode(r_frame)
-            for packet in packets:
-                yield stream_processor_pb2.AudioChunk(
-                    session_id=session_id,
-                    audio_data=bytes(packet)
-                )
-    
-    # Flush encoder
-    packets = output_stream.encode(None)
-    for packet in packets:
-        yield stream_processor_pb2.AudioChunk(
-            session_id=session_id,
-            audio_data=bytes(packet)
-        )
+def get_audio_chunks(packets, session_id="test_room:test_user"):
+    """Wrap encoded Opus packets (see the opus_packets fixture) in the AudioChunks the SFU would send."""
+    AudioChunk = stream_processor_pb2.AudioChunk
+    return [AudioChunk(session_id=session_id, audio_data=packet) for packet in packets]
 
 @pytest.mark.asyncio
-async def test_e2e_audio_stream(grpc_server, mock_redis):
-    if not os.path.exists(AUDIO_FILE):
-        pytest.skip(f"Audio file {AUDIO_FILE} not found")
-
+async def test_e2e_audio_stream(grpc_server, mock_redis, opus_packets):
     async with grpc.aio.insecure_channel(grpc_server) as channel:
         stub = stream_processor_pb2_grpc.CaptioningServiceStub(channel)
         
@@ -112,11 +66,10 @@ async def test_e2e_audio_stream(grpc_server, mock_redis):
         
         session_id = "e2e_room:e2e_user"
         
-        # Pre-calculate chunks to avoid blocking the event loop during the gRPC call
-        # (Opus encoding in get_audio_chunks is synchronous and CPU bound)
-        print("Pre-encoding audio chunks...")
-        request_chunks = list(get_audio_chunks(AUDIO_FILE, session_id=session_id))
-        print(f"Encoded {len(request_chunks)} chunks.")
+        # Chunks are built from packets encoded ahead of time (Opus encoding is synchronous
+        # and CPU bound, so it must not run on the event loop during the gRPC call)
+        request_chunks = get_audio_chunks(opus_packets, session_id=session_id)
+        print(f"Sending {len(request_chunks)} chunks.")
 
         responses = []
         async for response in stub.StreamAudio(iter(request_chunks)):
@@ -131,19 +84,21 @@ async def test_e2e_audio_stream(grpc_server, mock_redis):
         assert len(first_caption.text) > 0
         
         # Check Redis side effect
-        # We expect rpush to be called for each caption
-        assert mock_redis.rpush.called
+        # We expect rpush to be queued on a pipeline for each caption
+        pipe = mock_redis.pipeline.return_value
+        assert pipe.rpush.called
+        assert pipe.execute.await_count >= 1
         
         # Inspect one of the calls
-        args, _ = mock_redis.rpush.call_args
+        args, _ = pipe.rpush.call_args
         key = args[0]
         val = args[1]
         
-        assert key == "transcript:e2e_room"
+        assert key == b"transcript:e2e_room"
         data = json.loads(val)
         assert data["user_id"] == "e2e_user"
         assert "text" in data
-        assert "timestamp" in data
+        assert "ts_ns" in data
         
         # Verify text content roughly matches known transcript
         full_text = " ".join([r.text for r in responses])
@@ -9,7 +9,7 @@ from main import CaptioningService
 @pytest.fixture
 def service_with_mocks():
     with patch("main.AudioTranscriber") as MockTranscriber, \
-         patch("main.redis.Redis") as MockRedis:
+         patch("main.aioredis.Redis") as MockRedis:
         
         service = CaptioningService()
         
@@ -30,7 +30,8 @@ async def test_redis_failure_graceful(service_with_mocks):
     If Redis fails, the stream should still return captions to the client.
     """
     # Configure Redis to raise exception
-    service_with_mocks.redis_client.rpush.side_effect = Exception("Redis connection lost")
+    pipe = service_with_mocks.redis_client.pipeline.return_value
+    pipe.execute = AsyncMock(side_effect=Exception("Redis connection lost"))
     
     session_id = "error_room:user1"
     chunk_data = b'\x00' * 100000 # Trigger threshold
@@ -46,7 +47,8 @@ async def test_redis_failure_graceful(service_with_mocks):
     assert len(responses) == 1
     assert responses[0].text == "Error Proof"
     # Verify Redis attempt was made
-    service_with_mocks.redis_client.rpush.assert_called()
+    pipe.rpush.assert_called()
+    pipe.execute.assert_awaited()
 
 @pytest.mark.asyncio
 async def test_invalid_audio_data(service_with_mocks):
@@ -7,7 +7,7 @@ from main import CaptioningService
 @pytest.fixture
 def service_mock_transcriber():
     with patch("main.AudioTranscriber") as MockTranscriber, \
-         patch("main.redis.Redis") as MockRedis:
+         patch("main.aioredis.Redis") as MockRedis:
         
         service = CaptioningService()
         service.transcriber.transcribe_chunk = AsyncMock(return_value=[])
@@ -40,3 +40,30 @@ async def test_target_language_propagation(service_mock_transcriber):
     
     # Check if target_language was passed in kwargs
     assert kwargs.get('target_language') == "fr"
+
+@pytest.mark.asyncio
+async def test_english_sessions_use_en_model(monkeypatch):
+    monkeypatch.setenv("WHISPER_EN_MODEL", "tiny.en")
+    with patch("main.AudioTranscriber", side_effect=lambda model_size: MagicMock(name=model_size)), \
+         patch("main.aioredis.Redis"):
+        service = CaptioningService()
+    service.decode_chunk = MagicMock(side_effect=lambda s, d: d)
+    service.cleanup_session = MagicMock()
+    service.transcriber.transcribe_chunk = AsyncMock(return_value=[])
+    service.en_transcriber.transcribe_chunk = AsyncMock(return_value=[])
+
+    async def iterator(target_lang):
+        yield stream_processor_pb2.AudioChunk(
+            session_id="lang_room:user1",
+            audio_data=b'\x00' * 100000,
+            target_language=target_lang
+        )
+
+    for target_lang in ["en", "fr"]:
+        async for _ in service.StreamAudio(iterator(target_lang), None):
+            pass
+
+    service.en_transcriber.transcribe_chunk.assert_called_once()
+    assert service.en_transcriber.transcribe_chunk.call_args.kwargs["target_language"] == "en"
+    service.transcriber.transcribe_chunk.assert_called_once()
+    assert service.transcriber.transcribe_chunk.call_args.kwargs["target_language"] == "fr"
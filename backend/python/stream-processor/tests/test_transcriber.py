@@ -1,30 +1,58 @@
+import asyncio
 import pytest
 from unittest.mock import MagicMock, patch, AsyncMock
 import numpy as np
+import transcriber as transcriber_module
 from transcriber import AudioTranscriber
 
+@pytest.fixture(autouse=True)
+def clear_model_cache():
+    # Models are cached per process, keep the patched WhisperModel from leaking between tests
+    transcriber_module.load_model.cache_clear()
+    yield
+    transcriber_module.load_model.cache_clear()
+
+def make_segment(text, start, end, avg_logprob=-0.1):
+    segment = MagicMock()
+    segment.start = start
+    segment.end = end
+    segment.text = text
+    segment.avg_logprob = avg_logprob
+    segment.no_speech_prob = 0.0
+    return segment
+
+def make_audio(n_bytes):
+    """Constant 16-bit PCM at 0.125 full scale (not silence)."""
+    return b'\x00\x10' * (n_bytes // 2)
+
 @pytest.fixture
-def mock_whisper():
-    with patch("transcriber.WhisperModel") as MockClass:
-        mock_instance = MockClass.return_value
+def mock_model():
+    """Patched WhisperModel class, for tests that check how the model is loaded."""
+    with patch("transcriber.WhisperModel") as MockModel:
+        # Warmup call made when the model loads
+        MockModel.return_value.transcribe.return_value = ([], None)
+        yield MockModel
+
+@pytest.fixture
+def mock_whisper(mock_model):
+    with patch("transcriber.BatchedInferencePipeline") as MockPipeline, \
+         patch("transcriber.get_speech_timestamps") as mock_vad:
+        # Treat the whole chunk as speech
+        mock_vad.side_effect = lambda audio, options: [{"start": 0, "end": len(audio)}]
+
+        mock_instance = MockPipeline.return_value
         # Mock the transcribe method
         # It returns (segments, info)
-        Segment = MagicMock()
-        Segment.start = 0.0
-        Segment.end = 1.0
-        Segment.text = " Hello world"
-        Segment.avg_logprob = -0.1
-        
-        mock_instance.transcribe.return_value = ([Segment], None)
+        mock_instance.transcribe.return_value = ([make_segment(" Hello world", 0.0, 1.0)], None)
         yield mock_instance
 
 @pytest.mark.asyncio
 async def test_transcribe_chunk_en(mock_whisper):
     transcriber = AudioTranscriber(model_size="tiny", device="cpu")
     
-    # Create dummy audio data (1 second of silence)
+    # Create dummy audio data (1 second, loud enough to pass the silence gate)
     # 16000 samples, 2 bytes per sample = 32000 bytes
-    dummy_audio = bytes(32000)
+    dummy_audio = make_audio(32000)
     
     results = await transcriber.transcribe_chunk(dummy_audio, target_language="en")
     
@@ -33,11 +61,14 @@ async def test_transcribe_chunk_en(mock_whisper):
     assert len(results) == 1
     assert results[0]["text"] == "Hello world"
     assert results[0]["confidence"] == -0.1
+    # Greedy decoding unless WHISPER_BEAM says otherwise
+    _, kwargs = mock_whisper.transcribe.call_args
+    assert kwargs["beam_size"] == 1
 
 @pytest.mark.asyncio
 async def test_transcribe_chunk_es_translation(mock_whisper):
     transcriber = AudioTranscriber(model_size="tiny", device="cpu")
-    dummy_audio = bytes(32000)
+    dummy_audio = make_audio(32000)
     
     # When target is 'es' (Spanish), logic says language="es" (if not en)
     # Wait, the logic in transcriber.py says:
@@ -51,3 +82,175 @@ async def test_transcribe_chunk_es_translation(mock_whisper):
     # But we can check results
     assert len(results) == 1
     assert results[0]["text"] == "Hello world"
+
+@pytest.mark.asyncio
+async def test_concurrent_chunks_share_one_batch(mock_whisper):
+    transcriber = AudioTranscriber(model_size="tiny", device="cpu")
+
+    # Two 1 second chunks end up back to back in the batch buffer, so the second
+    # one's segment starts at 1.0s
+    mock_whisper.transcribe.return_value = ([
+        make_segment(" First session", 0.0, 1.0),
+        make_segment(" Second session", 1.0, 2.0),
+    ], None)
+
+    first, second = await asyncio.gather(
+        transcriber.transcribe_chunk(make_audio(32000)),
+        transcriber.transcribe_chunk(make_audio(32000)),
+    )
+
+    mock_whisper.transcribe.assert_called_once()
+    _, kwargs = mock_whisper.transcribe.call_args
+    assert len(kwargs["clip_timestamps"]) == 2
+
+    assert [r["text"] for r in first] == ["First session"]
+    assert [r["text"] for r in second] == ["Second session"]
+    # Timestamps are relative to each chunk
+    assert second[0]["start"] == 0.0
+
+@pytest.mark.asyncio
+async def test_max_batch_size_from_env(mock_whisper, monkeypatch):
+    monkeypatch.setenv("WHISPER_MAX_BATCH", "1")
+    transcriber = AudioTranscriber(model_size="tiny", device="cpu")
+
+    await asyncio.gather(
+        transcriber.transcribe_chunk(make_audio(32000)),
+        transcriber.transcribe_chunk(make_audio(32000)),
+    )
+
+    # Capped at one chunk per batch: each goes through its own forward pass
+    assert mock_whisper.transcribe.call_count == 2
+    for _, kwargs in mock_whisper.transcribe.call_args_list:
+        assert len(kwargs["clip_timestamps"]) == 1
+
+@pytest.mark.asyncio
+async def test_vad_trims_before_batching(mock_whisper):
+    transcriber = AudioTranscriber(model_size="tiny", device="cpu")
+
+    # Silence never reaches the model
+    with patch("transcriber.get_speech_timestamps", return_value=[]):
+        assert await transcriber.transcribe_chunk(make_audio(32000)) == []
+    mock_whisper.transcribe.assert_not_called()
+
+    # Speech from 0.5s to 1.5s: only that span is batched, times stay relative to the chunk
+    with patch("transcriber.get_speech_timestamps", return_value=[{"start": 8000, "end": 24000}]):
+        results = await transcriber.transcribe_chunk(make_audio(64000))
+
+    args, _ = mock_whisper.transcribe.call_args
+    assert len(args[0]) == 16000
+    assert results[0]["start"] == 0.5
+    assert results[0]["end"] == 1.5
+
+def test_compute_type_follows_device(mock_model, monkeypatch):
+    monkeypatch.delenv("WHISPER_COMPUTE_TYPE", raising=False)
+
+    monkeypatch.setenv("WHISPER_DEVICE", "cuda")
+    AudioTranscriber(model_size="tiny")
+    _, kwargs = mock_model.call_args
+    assert kwargs["device"] == "cuda"
+    assert kwargs["compute_type"] == "int8_float16"
+
+    # Explicit arguments win over the environment
+    AudioTranscriber(model_size="tiny", device="cpu")
+    _, kwargs = mock_model.call_args
+    assert kwargs["device"] == "cpu"
+    assert kwargs["compute_type"] == "int8"
+
+@pytest.mark.asyncio
+async def test_transcribe_chunk_reads_buffer_in_place(mock_whisper):
+    transcriber = AudioTranscriber(model_size="tiny", device="cpu")
+
+    # Session buffers are handed over as bytearrays, odd trailing bytes are dropped
+    buffer = bytearray(b'\x00\x40' * 16000 + b'\x01')
+    results = await transcriber.transcribe_chunk(buffer)
+
+    assert len(results) == 1
+    audio = mock_whisper.transcribe.call_args.args[0]
+    assert audio.dtype == np.float32
+    assert len(audio) == 16000
+    assert audio[0] == 0.5
+    # The caller's buffer is left untouched
+    assert len(buffer) == 32001
+
+def test_model_is_loaded_once(mock_model):
+    first = AudioTranscriber(model_size="tiny", device="cpu")
+    second = AudioTranscriber(model_size="tiny", device="cpu")
+
+    mock_model.assert_called_once()
+    assert first.model is second.model
+
+def test_cpu_threads_split_physical_cores(mock_model, monkeypatch):
+    with patch("transcriber.physical_cores", return_value=8), \
+         patch("transcriber.cpu_quota", return_value=None):
+        monkeypatch.delenv("WHISPER_CPU_THREADS", raising=False)
+        monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+
+        monkeypatch.setenv("WHISPER_NUM_WORKERS", "2")
+        AudioTranscriber(model_size="tiny", device="cpu")
+        _, kwargs = mock_model.call_args
+        assert kwargs["num_workers"] == 2
+        assert kwargs["cpu_threads"] == 4
+
+        monkeypatch.setenv("WHISPER_CPU_THREADS", "3")
+        AudioTranscriber(model_size="tiny", device="cpu")
+        _, kwargs = mock_model.call_args
+        assert kwargs["cpu_threads"] == 3
+
+def test_cpu_threads_capped_by_quota_and_omp(monkeypatch):
+    monkeypatch.delenv("WHISPER_CPU_THREADS", raising=False)
+    monkeypatch.delenv("WHISPER_NUM_WORKERS", raising=False)
+    monkeypatch.delenv("OMP_NUM_THREADS", raising=False)
+
+    with patch("transcriber.physical_cores", return_value=64):
+        # e.g. docker --cpus=1.5 on a big node
+        with patch("transcriber.cpu_quota", return_value=2):
+            assert transcriber_module.default_cpu_threads(1) == 2
+
+        monkeypatch.setenv("OMP_NUM_THREADS", "3")
+        with patch("transcriber.cpu_quota", return_value=None):
+            assert transcriber_module.default_cpu_threads(1) == 3
+
+@pytest.mark.asyncio
+async def test_batches_reuse_scratch_buffer(mock_whisper):
+    transcriber = AudioTranscriber(model_size="tiny", device="cpu")
+
+    await transcriber.transcribe_chunk(make_audio(64000))
+    first = mock_whisper.transcribe.call_args.args[0]
+    await transcriber.transcribe_chunk(b'\x00\x40' * 16000)
+    second = mock_whisper.transcribe.call_args.args[0]
+
+    # The second (smaller) batch is written into the first one's buffer
+    assert np.shares_memory(first, second)
+    assert len(second) == 16000
+    assert second[0] == 0.5
+
+def test_device_defaults_to_cuda_when_available(mock_model, monkeypatch):
+    with patch("transcriber.ctranslate2.get_cuda_device_count", return_value=1):
+        monkeypatch.delenv("WHISPER_DEVICE", raising=False)
+        monkeypatch.delenv("WHISPER_COMPUTE_TYPE", raising=False)
+
+        AudioTranscriber(model_size="tiny")
+        _, kwargs = mock_model.call_args
+        assert kwargs["device"] == "cuda"
+        assert kwargs["compute_type"] == "int8_float16"
+
+@pytest.mark.asyncio
+async def test_beam_size_per_call(mock_whisper):
+    transcriber = AudioTranscriber(model_size="tiny", device="cpu")
+
+    await transcriber.transcribe_chunk(make_audio(32000), beam_size=5)
+    _, kwargs = mock_whisper.transcribe.call_args
+    assert kwargs["beam_size"] == 5
+    assert kwargs["without_timestamps"] is True
+
+@pytest.mark.asyncio
+async def test_silent_chunk_skips_vad_and_model(mock_whisper):
+    transcriber = AudioTranscriber(model_size="tiny", device="cpu")
+
+    # Digital silence and near-silence (about -60 dBFS) never get to VAD
+    with patch("transcriber.get_speech_timestamps") as mock_vad:
+        assert await transcriber.transcribe_chunk(bytes(32000)) == []
+        assert await transcriber.transcribe_chunk(b'\x20\x00' * 16000) == []
+        assert await transcriber.transcribe_chunk(b"") == []
+    mock_vad.assert_not_called()
+    mock_whisper.transcribe.assert_not_called()
@@ -1,36 +1,173 @@
 import asyncio
+import bisect
+import ctranslate2
+import functools
 import logging
+import math
 import numpy as np
 import os
-from faster_whisper import WhisperModel
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from faster_whisper import BatchedInferencePipeline, WhisperModel
+from faster_whisper.vad import VadOptions, get_speech_timestamps
 
 logger = logging.getLogger(__name__)
 
+SAMPLE_RATE = 16000
+
+# Scale factor mapping 16-bit PCM onto [-1.0, 1.0)
+INT16_SCALE = np.float32(1.0 / 32768.0)
+
+# Chunks quieter than this RMS (about -46 dBFS, e.g. a muted mic) are silence, no VAD or model needed
+SILENCE_RMS = 0.005
+
+# Micro-batching: chunks from any session that arrive within this window are
+# transcribed together in a single batched forward pass.
+# Defaults, overridable with WHISPER_BATCH_WINDOW_MS / WHISPER_MAX_BATCH.
+BATCH_WINDOW_S = 0.02
+MAX_BATCH_SIZE = 8
+
+def physical_cores():
+    """
+    Number of physical cores this process may run on. Hyperthread siblings share a
+    core's L1/L2 and int8 GEMM units, so CTranslate2 gains nothing from using both.
+    """
+    cpus = os.sched_getaffinity(0) if hasattr(os, "sched_getaffinity") else range(os.cpu_count() or 1)
+    cores = set()
+    for cpu in cpus:
+        try:
+            with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/core_cpus_list") as f:
+                cores.add(f.read().strip())
+        except OSError:
+            # No topology info (non-Linux), count logical CPUs
+            cores.add(str(cpu))
+    return max(1, len(cores))
+
+def cpu_quota():
+    """
+    CPUs granted by the cgroup CFS quota (docker --cpus, k8s CPU limits), rounded up,
+    or None if there is no quota. sched_getaffinity doesn't reflect quotas.
+    """
+    try:
+        # cgroup v2: "<quota> <period>", quota is "max" when unlimited
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        try:
+            # cgroup v1: quota is -1 when unlimited
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+                quota = f.read().strip()
+            with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+                period = f.read().strip()
+        except OSError:
+            return None
+    if quota in ("max", "-1"):
+        return None
+    return max(1, math.ceil(int(quota) / int(period)))
+
+def default_cpu_threads(num_workers):
+    """
+    Intra-op threads per model replica when WHISPER_CPU_THREADS isn't set: the physical
+    cores split between replicas, capped by the cgroup CPU quota and by OMP_NUM_THREADS
+    (which CTranslate2 would otherwise use and a non-zero cpu_threads overrides).
+    """
+    cpus = physical_cores()
+    quota = cpu_quota()
+    if quota:
+        cpus = min(cpus, quota)
+    try:
+        cpus = min(cpus, int(os.environ["OMP_NUM_THREADS"]))
+    except (KeyError, ValueError):
+        pass
+    return max(1, cpus // num_workers)
+
+@functools.lru_cache(maxsize=None)
+def load_model(model_size, device, compute_type, num_workers=1, cpu_threads=0):
+    """
+    Load a Whisper model once per process.
+    Loading maps and warms hundreds of MB of weights, so every AudioTranscriber
+    (and every test) with the same settings shares one instance.
+    """
+    # Check for local model
+    local_model_path = os.path.join(os.path.dirname(__file__), "models", model_size)
+    if os.path.exists(local_model_path):
+        logger.info(f"Loading local Whisper model from {local_model_path}")
+        model_path_or_size = local_model_path
+    else:
+        logger.info(f"Downloading/Loading Whisper model: {model_size}")
+        model_path_or_size = model_size
+
+    model = WhisperModel(
+        model_path_or_size,
+        device=device,
+        compute_type=compute_type,
+        num_workers=num_workers,
+        cpu_threads=cpu_threads,
+    )
+
+    # Warm up on a second of silence so kernel selection and weight page-in happen
+    # now rather than on the first real chunk
+    segments, _ = model.transcribe(np.zeros(SAMPLE_RATE, dtype=np.float32), language="en", beam_size=1)
+    list(segments)
+
+    logger.info(f"Loaded Whisper model: {model_size} on {device} ({compute_type})")
+    return model
+
 class AudioTranscriber:
-    def __init__(self, model_size="tiny", device="cpu", compute_type="int8"):
-        # Check for local model
-        local_model_path = os.path.join(os.path.dirname(__file__), "models", model_size)
-        if os.path.exists(local_model_path):
-            logger.info(f"Loading local Whisper model from {local_model_path}")
-            model_path_or_size = local_model_path
-        else:
-            logger.info(f"Downloading/Loading Whisper model: {model_size}")
-            model_path_or_size = model_size
-
-        self.model = WhisperModel(model_path_or_size, device=device, compute_type=compute_type)
-        logger.info(f"Loaded Whisper model: {model_size} on {device}")
-
-    async def transcribe_chunk(self, audio_data: bytes, target_language: str = None, sample_rate=16000):
+    def __init__(self, model_size="tiny", device=None, compute_type=None):
+        # Device and quantization are deployment settings. On CPU int8 hits CTranslate2's
+        # int8 GEMM kernels; on CUDA int8_float16 keeps int8 weights with fp16 activations,
+        # roughly halving VRAM compared to float16.
+        device = device or os.getenv("WHISPER_DEVICE") or (
+            "cuda" if ctranslate2.get_cuda_device_count() > 0 else "cpu"
+        )
+        compute_type = compute_type or os.getenv("WHISPER_COMPUTE_TYPE") or (
+            "int8" if device == "cpu" else "int8_float16"
+        )
+        # Model replicas, lets concurrent transcribe calls from worker threads run in parallel
+        self.num_workers = int(os.getenv("WHISPER_NUM_WORKERS", 1))
+        # Greedy decoding by default, beam search costs beam_size times the decoder work per token
+        self.beam_size = int(os.getenv("WHISPER_BEAM", 1))
+        # Wider windows and bigger batches trade a little latency for throughput under load
+        self.batch_window_s = float(os.getenv("WHISPER_BATCH_WINDOW_MS", BATCH_WINDOW_S * 1000)) / 1000
+        self.max_batch_size = max(1, int(os.getenv("WHISPER_MAX_BATCH", MAX_BATCH_SIZE)))
+
+        # Intra-op threads per replica, an explicit WHISPER_CPU_THREADS wins
+        cpu_threads = int(os.getenv("WHISPER_CPU_THREADS", 0)) or default_cpu_threads(self.num_workers)
+
+        self.model = load_model(model_size, device, compute_type, self.num_workers, cpu_threads)
+
+        self.pipeline = BatchedInferencePipeline(model=self.model)
+        self.vad_options = VadOptions(min_silence_duration_ms=500, max_speech_duration_s=30)
+
+        # Pending requests and the task batching them, created on first use so they
+        # bind to the running event loop
+        self._queue = None
+        self._batch_task = None
+        # Batches run on dedicated threads, one per model replica, so inference never
+        # competes with other work on the default to_thread pool
+        self._executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="whisper")
+        # VAD gets its own thread too: it must not queue behind inference, and on the shared
+        # to_thread pool it would contend with every session's Opus decoding
+        self._vad_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="vad")
+        # Per executor thread float32 scratch buffer the batch audio is concatenated into
+        self._local = threading.local()
+
+    async def transcribe_chunk(self, audio_data, target_language: str = None, sample_rate=16000, beam_size: int = None):
         """
-        Transcribe or translate a chunk of raw audio bytes.
+        Transcribe or translate a chunk of raw 16-bit PCM.
+        audio_data can be any bytes-like object (bytes, bytearray, memoryview), it is read in place.
+        beam_size defaults to greedy decoding (WHISPER_BEAM), pass e.g. 5 for offline quality.
         """
-        if len(audio_data) % 2 != 0:
-            # logger.warning(f"Received odd byte length {len(audio_data)}, padding with one zero byte.")
-            audio_data += b'\x00'
+        # View the PCM as int16 without copying it. A trailing odd byte (half a sample) is ignored.
+        samples = np.frombuffer(audio_data, dtype=np.int16, count=len(audio_data) // 2)
 
-        # Convert bytes to float32 numpy array
-        # Assuming 16-bit PCM
-        audio_np = np.frombuffer(audio_data, dtype=np.int16).astype(np.float32) / 32768.0
+        # Convert 16-bit PCM to float32 in a single pass (widen + scale fused into one ufunc,
+        # instead of astype() and a division each materializing a float array).
+        # Output is allocated per call: it stays queued until its batch runs, so a shared
+        # scratch buffer would get clobbered by other sessions.
+        audio_np = np.empty(samples.shape, dtype=np.float32)
+        np.multiply(samples, INT16_SCALE, out=audio_np)
 
         # Determine task and language params
         task = "transcribe"
@@ -45,25 +182,159 @@ class AudioTranscriber:
                 # If the user asks for "es", we assume they mean the SOURCE is "es" and they want transcription.
                 # Or we fallback to transcription in that language.
                 language = target_language.lower()
-        
-        # Run transcription in a separate thread
-        segments, info = await asyncio.to_thread(
-            self.model.transcribe, 
-            audio_np, 
-            beam_size=5,
+
+        # Energy gate: one BLAS dot product, no temporaries
+        if len(audio_np) == 0 or np.dot(audio_np, audio_np) < SILENCE_RMS ** 2 * len(audio_np):
+            return []
+
+        # Trim leading/trailing silence up front. Silent chunks (most of a real meeting)
+        # never reach the model or wait on a batch, and only speech gets batched.
+        loop = asyncio.get_running_loop()
+        speech = await loop.run_in_executor(self._vad_executor, get_speech_timestamps, audio_np, self.vad_options)
+        if not speech:
+            return []
+        start = speech[0]["start"]
+
+        results = await self._submit(audio_np[start:speech[-1]["end"]], task, language, beam_size or self.beam_size)
+
+        # Report times relative to the untrimmed chunk
+        trimmed = start / SAMPLE_RATE
+        for result in results:
+            result["start"] += trimmed
+            result["end"] += trimmed
+        return results
+
+    async def _submit(self, audio_np, task, language, beam_size):
+        """Queue a chunk for the next batch and wait for its segments."""
+        loop = asyncio.get_running_loop()
+        if self._batch_task is None or self._batch_task.done() or self._batch_task.get_loop() is not loop:
+            self._queue = asyncio.Queue()
+            self._batch_task = loop.create_task(self._batch_worker())
+
+        future = loop.create_future()
+        self._queue.put_nowait((audio_np, task, language, beam_size, future))
+        return await future
+
+    async def _batch_worker(self):
+        loop = asyncio.get_running_loop()
+        # One batch in flight per model replica. While they are busy, new chunks keep
+        # queueing up and go out together as the next (bigger) batch.
+        replicas = asyncio.Semaphore(self.num_workers)
+        while True:
+            await replicas.acquire()
+            batch = [await self._queue.get()]
+
+            # Collect whatever else arrives within the batching window
+            deadline = loop.time() + self.batch_window_s
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            job = loop.run_in_executor(self._executor, self._run_batch, [request[:-1] for request in batch])
+            job.add_done_callback(
+                functools.partial(self._finish_batch, [request[-1] for request in batch], replicas)
+            )
+
+    def _finish_batch(self, futures, replicas, job):
+        replicas.release()
+        try:
+            results = job.result()
+        except Exception as e:
+            results = [e] * len(futures)
+
+        for future, result in zip(futures, results):
+            if future.done():
+                # Caller went away (e.g. stream cancelled)
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def _run_batch(self, requests):
+        """Transcribe a batch of (audio, task, language, beam_size) requests, one result (or exception) per request."""
+        # A forward pass shares one tokenizer and decoding setup, so chunks are grouped by task/language/beam
+        groups = {}
+        for i, (audio, *options) in enumerate(requests):
+            groups.setdefault(tuple(options), []).append(i)
+
+        results = [None] * len(requests)
+        for options, indices in groups.items():
+            try:
+                group_results = self._transcribe_batch([requests[i][0] for i in indices], *options)
+            except Exception as e:
+                logger.error(f"Batched transcription failed: {e}")
+                group_results = [e] * len(indices)
+            for i, result in zip(indices, group_results):
+                results[i] = result
+
+        return results
+
+    def _batch_buffer(self, size):
+        """Return this thread's scratch buffer sized to hold size samples, growing it if needed."""
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None or len(buffer) < size:
+            buffer = self._local.buffer = np.empty(size, dtype=np.float32)
+        return buffer[:size]
+
+    def _transcribe_batch(self, audios, task, language, beam_size):
+        """
+        Transcribe several chunks in one batched forward pass.
+        Returns a list of segment dicts per chunk, in input order.
+        """
+        # Each (already VAD-trimmed) chunk becomes one clip of a concatenated buffer. The
+        # pipeline decodes every clip as its own batch item, so text never bleeds between sessions.
+        clips = []
+        offset = 0
+        for audio in audios:
+            clips.append({"start": offset / SAMPLE_RATE, "end": (offset + len(audio)) / SAMPLE_RATE})
+            offset += len(audio)
+
+        results = [[] for _ in audios]
+
+        # When auto-detecting, the language is detected per clip (sessions may speak
+        # different languages); "en" only seeds the prompt and is replaced per item.
+        multilingual = language is None and self.model.model.is_multilingual
+        # The pipeline computes features from the audio before returning, so the
+        # buffer is free for the next batch on this thread once transcribe() returns
+        audio = self._batch_buffer(offset)
+        np.concatenate(audios, out=audio)
+
+        segments, _ = self.pipeline.transcribe(
+            audio,
+            beam_size=beam_size,
+            best_of=1,
+            temperature=0.0,
             task=task,
-            language=language,
-            vad_filter=True,
-            vad_parameters=dict(min_silence_duration_ms=500)
+            language=language or "en",
+            multilingual=multilingual,
+            vad_filter=False,
+            # One segment per clip starting at the clip, which the demuxing below relies on.
+            # (The batched pipeline never conditions on previous text, chunks decode independently.)
+            without_timestamps=True,
+            clip_timestamps=clips,
+            batch_size=len(clips),
         )
 
-        results = []
+        clip_starts = [clip["start"] for clip in clips]
         for segment in segments:
-            results.append({
-                "start": segment.start,
-                "end": segment.end,
+            # Same no-speech filter the sequential decoder applies
+            if segment.no_speech_prob > 0.6 and segment.avg_logprob < -1.0:
+                continue
+
+            # Segment times are relative to the concatenated buffer, map back to the chunk
+            owner = bisect.bisect_right(clip_starts, segment.start + 1e-3) - 1
+            base = clip_starts[owner]
+            results[owner].append({
+                "start": segment.start - base,
+                "end": segment.end - base,
                 "text": segment.text.strip(),
                 "confidence": segment.avg_logprob
             })
-        
+
         return results
@@ -1,14 +1,14 @@
 import logging
 import os
-import json
-import redis
+import re
+import orjson
+import redis.asyncio as aioredis
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 import uvicorn
 from contextlib import asynccontextmanager
 
 import grpc
-from concurrent import futures
 from proto import summary_service_pb2
 from proto import summary_service_pb2_grpc
 
@@ -33,6 +33,19 @@ REPO_ID = "bartowski/Llama-3.2-3B-Instruct-GGUF"
 FILENAME = "Llama-3.2-3B-Instruct-Q4_K_M.gguf"
 MODEL_PATH = f"./models/{FILENAME}"
 
+# Kept identical across requests and always sent first: llama.cpp reuses the KV cache for the
+# longest prefix shared with the previous prompt, so this prefix is only evaluated once.
+SYSTEM_PROMPT = (
+    "You are an expert meeting assistant. "
+    "Summarize the following meeting transcript efficiently. "
+    "Then list actionable items."
+)
+
+# "Action Items:" heading in the model output, in any casing/spacing
+ACTION_ITEMS_RE = re.compile(r"action\s+items?\s*:", re.IGNORECASE)
+# Leading "Summary:" label the model tends to put in front of the summary itself
+SUMMARY_LABEL_RE = re.compile(r"^\s*summary\s*:\s*", re.IGNORECASE)
+
 llm = None
 
 @asynccontextmanager
@@ -68,7 +81,16 @@ async def lifespan(app: FastAPI):
     try:
         logger.info("Loading Llama model...")
         # n_ctx=2048 or higher for meeting transcripts. 4096 is safe for 3B.
-        llm = Llama(model_path=MODEL_PATH, n_ctx=8192, n_threads=6, verbose=True) 
+        # n_gpu_layers=-1 offloads every layer when llama.cpp is built with GPU support, no-op on CPU builds
+        llm = Llama(
+            model_path=MODEL_PATH,
+            n_ctx=8192,
+            n_threads=6,
+            n_batch=512,
+            n_ubatch=512,
+            n_gpu_layers=int(os.getenv("LLM_GPU_LAYERS", -1)),
+            verbose=True,
+        )
         logger.info("✅ Llama model loaded successfully")
     except Exception as e:
         logger.error(f"Failed to load Llama model: {e}")
@@ -80,44 +102,75 @@ async def lifespan(app: FastAPI):
 
 # --- App Setup ---
 app = FastAPI(title="Meeting Summarization Service", lifespan=lifespan)
-redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0, decode_responses=True)
+# Async client so LRANGE never blocks the event loop.
+# Raw bytes: events go straight to orjson.loads, no utf-8 decode into str first
+redis_client = aioredis.Redis(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=0,
+    decode_responses=False,
+    max_connections=50,
+    socket_keepalive=True,
+)
 
 # --- gRPC Service ---
+class TranscriptUnavailableError(Exception):
+    """The room's transcript could not be read from Redis."""
+
 class SummaryService(summary_service_pb2_grpc.SummaryServiceServicer):
     async def Summarize(self, request, context):
         room_id = request.room_id
         logger.info(f"Received gRPC summary request for room: {room_id}")
-        
+
+        # grpc.aio's abort is a coroutine that raises; return in case it doesn't (e.g. test doubles)
+        try:
+            summary, action_items = await self._summarize_room(room_id)
+        except TranscriptUnavailableError as e:
+            await context.abort(grpc.StatusCode.INTERNAL, f"Redis error: {e}")
+            return
+        except Exception as e:
+            logger.error(f"Failed to generate summary: {e}")
+            await context.abort(grpc.StatusCode.INTERNAL, "Failed to generate summary. Please check service logs.")
+            return
+
+        return summary_service_pb2.SummaryResponse(
+            room_id=room_id,
+            summary=summary,
+            action_items=action_items
+        )
+
+    async def _summarize_room(self, room_id):
+        """
+        Summarize a room's transcript, independent of the gRPC glue.
+        Returns (summary, action_items). Raises TranscriptUnavailableError when Redis
+        can't be read, LLM failures propagate.
+        """
         # 1. Fetch transcript from Redis
         try:
-            raw_events = redis_client.lrange(f"transcript:{room_id}", 0, -1)
+            raw_events = await redis_client.lrange(f"transcript:{room_id}", 0, -1)
             if not raw_events:
-                 # Return empty or error. For gRPC, we can return empty or abort.
-                 # Let's return empty response with no summary.
+                 # Nothing to summarize, answer with an empty summary rather than an error
                  logger.warning(f"No transcript found for room {room_id}")
-                 return summary_service_pb2.SummaryResponse(room_id=room_id, summary="No transcript found.", action_items=[])
+                 return "No transcript found.", []
             
-            transcript_text = ""
-            for event_str in raw_events:
-                event = json.loads(event_str)
-                transcript_text += f"{event.get('user_id', 'Unknown')}: {event.get('text', '')}\n"
-                
+            # Build the lines and join once instead of growing a string per event
+            transcript_text = "".join([
+                f"{event.get('user_id', 'Unknown')}: {event['text']}\n"
+                for event in map(orjson.loads, raw_events)
+                if event.get('text')
+            ])
+
         except Exception as e:
             logger.error(f"Error fetching from Redis: {e}")
-            context.abort(grpc.StatusCode.INTERNAL, f"Redis error: {e}")
+            raise TranscriptUnavailableError(str(e)) from e
+
+        if not transcript_text:
+            # Only empty captions, nothing worth running the LLM on
+            logger.warning(f"Transcript for room {room_id} has no text")
+            return "No transcript found.", []
 
         # 2. Call LLM
-        try:
-            summary, action_items = generate_summary(transcript_text)
-            
-            return summary_service_pb2.SummaryResponse(
-                room_id=room_id,
-                summary=summary,
-                action_items=action_items
-            )
-        except Exception as e:
-            logger.error(f"Failed to generate summary: {e}")
-            context.abort(grpc.StatusCode.INTERNAL, "Failed to generate summary. Please check service logs.")
+        return generate_summary(transcript_text)
 
 def generate_summary(text: str):
     if not llm:
@@ -125,18 +178,12 @@ def generate_summary(text: str):
         raise RuntimeError("LLM model not initialized")
 
     # Real Inference
-    system_prompt = (
-        "You are an expert meeting assistant. "
-        "Summarize the following meeting transcript efficiently. "
-        "Then list actionable items."
-    )
-    
     user_message = f"Transcript:\n{text}\n\nPlease provide:\n1. A concise summary.\n2. A list of action items."
     
     try:
         response = llm.create_chat_completion(
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": SYSTEM_PROMPT},
                 {"role": "user", "content": user_message}
             ],
             temperature=0.7,
@@ -145,26 +192,17 @@ def generate_summary(text: str):
         content = response['choices'][0]['message']['content']
         
         # Simple parsing (heuristic)
-        # We assume the model follows instructions roughly.
+        # We assume the model follows instructions roughly: everything before the
+        # "Action Items:" heading is the summary, each non-empty line after it an item.
         # Ideally we ask for JSON output for strict parsing, but clear text is fine for now.
-        summary = content
-        action_items = [] # Parsing specific items from text is hard without structure.
-        # Let's just return the whole text as summary for now to be safe, 
-        # or try to split if "Action Items:" exists.
-        
-        parts = content.split("Action Items:")
-        if len(parts) > 1:
-            summary = parts[0].strip()
-            # Split items by newline
-            raw_items = parts[1].strip().split('\n')
-            action_items = [item.strip('- *') for item in raw_items if item.strip()]
+        parts = ACTION_ITEMS_RE.split(content, maxsplit=1)
+        if len(parts) == 2:
+            summary = parts[0]
+            action_items = [item.strip().strip('-*• ') for item in parts[1].splitlines() if item.strip()]
         else:
-             # Try "Action items:" casing
-            parts = content.split("Action items:")
-            if len(parts) > 1:
-                summary = parts[0].strip()
-                raw_items = parts[1].strip().split('\n')
-                action_items = [item.strip('- *') for item in raw_items if item.strip()]
+            # No heading: return the whole text as summary to be safe
+            summary, action_items = content, []
+        summary = SUMMARY_LABEL_RE.sub("", summary, count=1).strip()
         
         return summary, action_items
 
@@ -178,7 +216,19 @@ async def health():
     return {"status": "ok"}
 
 async def serve_grpc():
-    server = grpc.aio.server(futures.ThreadPoolExecutor(max_workers=10))
+    # Handlers are all async and run on the event loop, so no thread pool is needed
+    server = grpc.aio.server(options=[
+        ("grpc.so_reuseport", 1),
+        ("grpc.max_concurrent_streams", 128),
+        ("grpc.http2.max_pings_without_data", 0),
+        # Keep long-lived streams alive through idle proxies/NATs and detect dead peers
+        ("grpc.keepalive_time_ms", 20000),
+        ("grpc.keepalive_timeout_ms", 10000),
+        ("grpc.http2.min_time_between_pings_ms", 10000),
+        # Let flow-control windows grow with the measured bandwidth-delay product
+        ("grpc.http2.bdp_probe", 1),
+        ("grpc.http2.write_buffer_size", 1 << 20),
+    ])
     summary_service_pb2_grpc.add_SummaryServiceServicer_to_server(SummaryService(), server)
     listen_addr = '[::]:50052' # Port 50052 for Summary Service
     server.add_insecure_port(listen_addr)
@@ -187,7 +237,8 @@ async def serve_grpc():
     await server.wait_for_termination()
 
 async def serve_http():
-    config = uvicorn.Config(app, host="0.0.0.0", port=8001, log_level="info")
+    # httptools: C HTTP/1.1 parser instead of pure-Python h11
+    config = uvicorn.Config(app, host="0.0.0.0", port=8001, log_level="info", http="httptools")
     server = uvicorn.Server(config)
     await server.serve()
 
@@ -197,4 +248,10 @@ async def main():
 
 if __name__ == "__main__":
     import asyncio
-    asyncio.run(main())
+    try:
+        # libuv-based event loop, faster socket I/O for gRPC/HTTP (not available on Windows)
+        import uvloop
+        run = uvloop.run
+    except ImportError:
+        run = asyncio.run
+    run(main())
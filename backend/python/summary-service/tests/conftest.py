@@ -0,0 +1,29 @@
+import contextlib
+from types import SimpleNamespace
+import fakeredis
+import pytest
+from unittest.mock import patch
+
+import main
+
+@pytest.fixture(scope="session", autouse=True)
+def patched_main():
+    """
+    main's external dependencies, patched once for the whole session:
+    - Llama is mocked, so nothing (e.g. the app lifespan) loads a real model
+    - redis_client is an in-memory Redis. Tests use their own room keys.
+    """
+    with contextlib.ExitStack() as stack:
+        yield SimpleNamespace(
+            llama=stack.enter_context(patch.object(main, "Llama")),
+            redis=stack.enter_context(patch.object(main, "redis_client", fakeredis.FakeAsyncRedis())),
+        )
+
+@pytest.fixture(scope="session")
+def fake_redis(patched_main):
+    return patched_main.redis
+
+@pytest.fixture(scope="session")
+def summary_service():
+    """A single SummaryService shared by all tests, it keeps no per-request state."""
+    return main.SummaryService()
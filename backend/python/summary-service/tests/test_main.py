@@ -1,57 +1,121 @@
 import pytest
-from unittest.mock import MagicMock, patch
+from unittest.mock import patch
 import json
+import grpc
 from proto import summary_service_pb2 as cc_pb2
 
-# Mock Llama before importing main
-with patch("main.Llama") as MockLlama:
-    from main import SummaryService, generate_summary, redis_client
-
-@pytest.mark.asyncio
-async def test_summarize_no_transcript():
-    service = SummaryService()
-    context = MagicMock()
-    request = MagicMock()
-    request.room_id = "test-room-empty"
-
-    # Mock Redis to return empty
-    with patch("main.redis_client") as mock_redis:
-        mock_redis.lrange.return_value = []
-        
-        response = await service.Summarize(request, context)
-        
-        assert response.summary == "No transcript found."
-        assert len(response.action_items) == 0
-
-@pytest.mark.asyncio
-async def test_summarize_with_transcript():
-    service = SummaryService()
-    context = MagicMock()
-    request = MagicMock()
-    request.room_id = "test-room-data"
-    
-    # Mock Redis
-    dataset = [
-        json.dumps({"user_id": "Alice", "text": "Hello team, let's discuss the roadmap."}),
-        json.dumps({"user_id": "Bob", "text": "Sure, I think we should focus on Q1 items."}),
-        json.dumps({"user_id": "Alice", "text": "Agreed. Bob, can you check the Jira tickets? Action Items: Check Jira."})
-    ]
-
-    with patch("main.redis_client") as mock_redis:
-        mock_redis.lrange.return_value = dataset
-        
-        # Mock LLM (main.llm is global)
-        with patch("main.llm") as mock_llm_instance:
-            mock_llm_instance.create_chat_completion.return_value = {
-                'choices': [{
-                    'message': {
-                        'content': "Summary: Team discussed roadmap. Action Items: \n- Check Jira"
-                    }
-                }]
-            }
-            
-            response = await service.Summarize(request, context)
-            
-            assert "roadmap" in response.summary
-            assert len(response.action_items) > 0
-            assert "Check Jira" in response.action_items[0]
+# Llama is mocked for the session in conftest.py
+from main import generate_summary
+
+DATASET = [
+    {"user_id": "Alice", "text": "Hello team, let's discuss the roadmap."},
+    {"user_id": "Bob", "text": "Sure, I think we should focus on Q1 items."},
+    {"user_id": "Alice", "text": "Agreed. Bob, can you check the Jira tickets? Action Items: Check Jira."},
+]
+# Serialized and encoded once at import, the bytes the stream processor would have written
+DATASET_JSON = tuple(json.dumps(event).encode() for event in DATASET)
+# A room whose captions all came out empty
+SILENT_JSON = (json.dumps({"user_id": "Alice", "text": ""}).encode(),)
+
+class FakeContext:
+    """Stand-in for grpc.aio.ServicerContext, records abort() calls."""
+    def __init__(self):
+        self.aborts = []
+
+    async def abort(self, code, details=""):
+        self.aborts.append((code, details))
+
+def chat_completion(content):
+    """The create_chat_completion() response shape we read from."""
+    return {'choices': [{'message': {'content': content}}]}
+
+# What generate_summary() parses the roadmap answer into
+EXPECTED_SUMMARY = "Team discussed roadmap."
+EXPECTED_ACTIONS = ["Check Jira"]
+
+# Canned model outputs, built once and keyed by the first transcript line of the prompt they answer
+LLM_RESPONSES = {
+    "Alice: Hello team, let's discuss the roadmap.":
+        chat_completion("Summary: Team discussed roadmap. Action Items: \n- Check Jira"),
+    "Alice: Let's ship it.":
+        chat_completion("Roadmap agreed.\n\nACTION ITEMS:\n- Check Jira\n\n* Book the review\n"),
+}
+
+def canned_completion(messages, **kwargs):
+    """create_chat_completion() stand-in, looks the answer up by the prompt's transcript."""
+    transcript = messages[-1]["content"].removeprefix("Transcript:\n")
+    return LLM_RESPONSES[transcript.split("\n", 1)[0]]
+
+@pytest.fixture(scope="module")
+def patched_llm():
+    """main.llm serving LLM_RESPONSES, configured once for the whole module."""
+    with patch("main.llm") as mock_llm_instance:
+        mock_llm_instance.create_chat_completion.side_effect = canned_completion
+        yield mock_llm_instance
+
+@pytest.fixture
+def mock_llm(patched_llm):
+    # Fresh call history per test, the canned side_effect stays
+    patched_llm.reset_mock()
+    return patched_llm
+
+
+async def load_transcript(redis, room_id, events):
+    """Replace a room's transcript with the given serialized events in one round trip."""
+    key = f"transcript:{room_id}"
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.delete(key)
+        pipe.rpush(key, *events)
+        await pipe.execute()
+
+@pytest.mark.parametrize("room_id,events,runs_llm,expect_summary,expect_actions", [
+    # Nothing was ever pushed for this room
+    ("test-room-empty", (), False, "No transcript found.", []),
+    # Only empty captions: nothing worth running the model on
+    ("test-room-silent", SILENT_JSON, False, "No transcript found.", []),
+    ("test-room-data", DATASET_JSON, True, EXPECTED_SUMMARY, EXPECTED_ACTIONS),
+], ids=["empty", "silent", "transcript"])
+async def test_summarize_room(summary_service, fake_redis, mock_llm, room_id, events, runs_llm, expect_summary, expect_actions):
+    if events:
+        await load_transcript(fake_redis, room_id, events)
+
+    summary, action_items = await summary_service._summarize_room(room_id)
+
+    assert (summary, action_items) == (expect_summary, expect_actions)
+    if not runs_llm:
+        mock_llm.create_chat_completion.assert_not_called()
+    else:
+        # Every transcript line made it into the prompt
+        prompt = mock_llm.create_chat_completion.call_args.kwargs["messages"][-1]["content"]
+        for event in map(json.loads, events):
+            assert f"{event['user_id']}: {event['text']}" in prompt
+
+async def test_summarize_response(summary_service, fake_redis, mock_llm):
+    context = FakeContext()
+    request = cc_pb2.SummaryRequest(room_id="test-room-rpc")
+    await load_transcript(fake_redis, "test-room-rpc", DATASET_JSON)
+
+    response = await summary_service.Summarize(request, context)
+
+    assert context.aborts == []
+    assert response.room_id == "test-room-rpc"
+    assert response.summary == EXPECTED_SUMMARY
+    assert list(response.action_items) == EXPECTED_ACTIONS
+
+async def test_summarize_redis_error_aborts(summary_service, fake_redis, mock_llm):
+    context = FakeContext()
+    request = cc_pb2.SummaryRequest(room_id="test-room-down")
+
+    with patch.object(fake_redis, "lrange", side_effect=ConnectionError("Redis down")):
+        response = await summary_service.Summarize(request, context)
+
+    assert response is None
+    assert [code for code, _ in context.aborts] == [grpc.StatusCode.INTERNAL]
+    # No inference on the failure path
+    mock_llm.create_chat_completion.assert_not_called()
+
+def test_generate_summary_parses_action_items(mock_llm):
+    summary, action_items = generate_summary("Alice: Let's ship it.")
+
+    assert summary == "Roadmap agreed."
+    assert action_items == ["Check Jira", "Book the review"]